@@ -3,14 +3,25 @@ import sys
 import logging
 import shutil
 import zipfile
-import math
+import mmap
 import concurrent.futures
 import subprocess
 import time
-import hashlib
 import json
+import heapq
+import math
+import re
+import struct
+import zlib
+import hashlib
+import threading
 from datetime import datetime
 
+try:
+    import fcntl  # Linux only, used for reflink snapshots
+except ImportError:
+    fcntl = None
+
 def set_executable_permission(file_path):
     """Set executable permission on Linux"""
     if sys.platform == 'linux':
@@ -49,68 +60,338 @@ except ImportError:
 # Ensure tqdm is installed
 try:
     from tqdm import tqdm
-except ImportError or ModuleNotFoundError:
+except ImportError:
     print("Installing required package: tqdm")
     subprocess.check_call([sys.executable, "-m", "pip", "install", "tqdm"])
     from tqdm import tqdm
 
+# Use blake3 for the backup fingerprint when it is installed, otherwise hashlib.blake2b
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# Use orjson for the backup records when it is installed, otherwise the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 os.system(CLEAR_SCREEN)
 
 minecraft_directory = os.path.dirname(os.path.abspath(__file__))
-
-def calculate_folder_hash(items_to_backup):
+UPDATER_DIR = os.path.join(minecraft_directory, 'updater')
+BACKUP_DIR = os.path.join(minecraft_directory, 'backup')
+SCRIPT_NAME = os.path.basename(__file__)
+HASH_FILE = os.path.join(BACKUP_DIR, 'backup_hashes.json')
+MANIFEST_FILE = os.path.join(BACKUP_DIR, 'backup_manifest.json')
+VERSION_FILE = os.path.join(UPDATER_DIR, 'server_version.txt')
+
+def _env_int(name, default):
+    """Read a positive integer setting from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"Warning: Invalid {name} '{value}', using {default}")
+        return default
+
+# Backup compression tiers: zstd level, LZMA2 method/level for 7z builds without zstd,
+# and deflate level for the zip fallback (None stores files uncompressed, since single-core
+# deflate is slower than a fast disk)
+COMPRESSION_TIERS = {
+    'fast':     {'zstd': 3,  'lzma2': ('LZMA2:d32m', 1),      'deflate': None},
+    'balanced': {'zstd': 10, 'lzma2': ('LZMA2:d32m:fb32', 3), 'deflate': 6},
+    'max':      {'zstd': 19, 'lzma2': ('LZMA2:d64m', 9),      'deflate': 9},
+}
+BACKUP_COMPRESSION = os.environ.get('MCBACKUP_COMPRESSION', 'fast').lower()
+if BACKUP_COMPRESSION not in COMPRESSION_TIERS:
+    print(f"Warning: Unknown compression tier '{BACKUP_COMPRESSION}', using 'fast'")
+    BACKUP_COMPRESSION = 'fast'
+
+# Download tuning: minimum chunk size in MB (override with MCBACKUP_CHUNK_MB) and parallel connections
+DOWNLOAD_CHUNK_SIZE = _env_int('MCBACKUP_CHUNK_MB', 8) * 1024 * 1024
+DOWNLOAD_WORKERS = min(16, (os.cpu_count() or 4) * 2)
+
+# Set MCBACKUP_SNAPSHOT=1 to back up into a plain folder of reflinked files instead of an archive
+BACKUP_SNAPSHOT = os.environ.get('MCBACKUP_SNAPSHOT', '') == '1'
+FICLONE = 0x40049409  # Linux ioctl that shares file extents (Btrfs, XFS, bcachefs)
+
+# Backups are incremental against the previous one, with a full backup every MCBACKUP_FULL_EVERY runs
+BACKUP_FULL_EVERY = _env_int('MCBACKUP_FULL_EVERY', 7)
+
+def get_7z_encoders(seven):
+    """Return the names of the codecs this 7z build can compress with"""
+    try:
+        result = subprocess.run([seven, 'i'], capture_output=True, text=True, errors='replace', check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+
+    encoders = set()
+    in_codecs = False
+    for line in result.stdout.splitlines():
+        if line.strip() == 'Codecs:':
+            in_codecs = True
+        elif in_codecs:
+            fields = line.split()
+            if not fields:
+                break
+            # Codec lines look like " 0 ED 4F71101 ZSTD": library, flags, id, name
+            if len(fields) >= 4 and 'E' in fields[1]:
+                encoders.add(fields[-1].upper())
+    return encoders
+
+def get_7z_method_args(seven):
+    """Build the 7z compression switches for the configured tier"""
+    tier = COMPRESSION_TIERS[BACKUP_COMPRESSION]
+    encoders = get_7z_encoders(seven)
+    threads = f'-mmt={os.cpu_count() or 1}'
+    # Fast LZMA2 matches LZMA2's ratio at higher speed, so it beats zstd when ratio matters most
+    if 'FLZMA2' in encoders and (BACKUP_COMPRESSION == 'max' or 'ZSTD' not in encoders):
+        return ['-m0=flzma2', f"-mx={tier['lzma2'][1]}", threads]
+    if 'ZSTD' in encoders:
+        return ['-m0=zstd', f"-mx={tier['zstd']}", threads]
+    method, level = tier['lzma2']
+    return [f'-m0={method}', f'-mx={level}', threads]
+
+def _iter_files(root):
+    """Yield an os.DirEntry for every file below root"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+def _stat_subtree(item):
+    """Return the sorted (relative path, size, mtime_ns) of every file in one top-level item"""
+    # DirEntry.stat() reuses what scandir already read where the platform allows
+    file_infos = []
+    prefix_len = len(minecraft_directory) + 1
+    item_path = os.path.join(minecraft_directory, item)
+    if os.path.isfile(item_path):
+        stat = os.stat(item_path)
+        file_infos.append((item, stat.st_size, stat.st_mtime_ns))
+    elif os.path.isdir(item_path):
+        append = file_infos.append  # Bound once; this loop runs for every file
+        for entry in _iter_files(item_path):
+            stat = entry.stat()
+            append((entry.path[prefix_len:], stat.st_size, stat.st_mtime_ns))
+    file_infos.sort()  # Sort to ensure consistent order
+    return file_infos
+
+def scan_backup_files(items_to_backup):
+    """Return the sorted (relative path, size, mtime_ns) of every file to back up"""
+    # Stat each top-level item on its own thread so slow disks serve several stats at once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        subtree_infos = list(executor.map(_stat_subtree, items_to_backup))
+    # Every subtree is sorted and prefixed by its item name, so merging keeps a global order
+    return list(heapq.merge(*subtree_infos))
+
+def calculate_folder_hash(file_infos):
     """Calculate a hash of the folder contents based on file names, sizes, and modification times"""
-    hasher = hashlib.sha256()
-    
-    for item in sorted(items_to_backup):  # Sort to ensure consistent order
-        item_path = os.path.join(minecraft_directory, item)
-        if os.path.isfile(item_path):
-            stat = os.stat(item_path)
-            # Hash file path, size and modification time
-            file_info = f"{item}|{stat.st_size}|{stat.st_mtime}".encode()
-            hasher.update(file_info)
-        elif os.path.isdir(item_path):
-            for root, dirs, files in os.walk(item_path):
-                for file in sorted(files):  # Sort to ensure consistent order
-                    file_path = os.path.join(root, file)
-                    stat = os.stat(file_path)
-                    # Hash relative path, size and modification time
-                    file_info = f"{os.path.relpath(file_path, minecraft_directory)}|{stat.st_size}|{stat.st_mtime}".encode()
-                    hasher.update(file_info)
-    
+    # Pack everything into one buffer: length-prefixed UTF-8 path, then size and mtime
+    buf = bytearray()
+    pack_length = struct.Struct('<I').pack
+    pack_stat = struct.Struct('<Qq').pack
+    for relpath, size, mtime_ns in file_infos:
+        path_bytes = relpath.encode('utf-8', 'surrogateescape')
+        buf += pack_length(len(path_bytes))
+        buf += path_bytes
+        buf += pack_stat(size, mtime_ns)
+
+    hasher = blake3.blake3() if blake3 is not None else hashlib.blake2b(digest_size=32)
+    hasher.update(buf)
     return hasher.hexdigest()
 
+def read_json(path):
+    """Read a JSON file, with orjson when available"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_json(path, data, indent=False):
+    """Write a JSON file, with orjson when available"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else None))
+        return
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2 if indent else None)
+
 def load_backup_hashes():
     """Load the backup hashes from the JSON file"""
-    hash_file = os.path.join(minecraft_directory, "backup", "backup_hashes.json")
-    if os.path.exists(hash_file):
+    if os.path.exists(HASH_FILE):
         try:
-            with open(hash_file, 'r') as f:
-                return json.load(f)
+            return read_json(HASH_FILE)
         except Exception:
             return {}
     return {}
 
 def save_backup_hashes(hashes):
     """Save the backup hashes to the JSON file"""
-    hash_file = os.path.join(minecraft_directory, "backup", "backup_hashes.json")
-    with open(hash_file, 'w') as f:
-        json.dump(hashes, f, indent=2)
+    write_json(HASH_FILE, hashes, indent=True)
+
+def snapshot_copy(src, dst):
+    """Copy a file for a snapshot, sharing its data blocks when possible. Returns True if reflinked"""
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            shutil.copystat(src, dst)
+            return True
+        except OSError:
+            pass
+    if hasattr(os, 'copy_file_range'):
+        try:
+            # Let the kernel copy the data without passing it through user space
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                remaining = os.fstat(s.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return False
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return False
+
+def _write_listfile(listfile, names):
+    """Write names relative to the server directory to listfile, one per line"""
+    with open(listfile, 'w', encoding='utf-8', errors='surrogateescape') as lf:
+        for name in names:
+            lf.write(name + '\n')
+
+def create_7z_archive(seven, backup_archive, names):
+    """Archive the named files and folders with 7z, raising CalledProcessError on failure"""
+    # Pass the names through a listfile instead of the command line
+    listfile = os.path.join(BACKUP_DIR, '.7z_listfile.txt')
+    try:
+        _write_listfile(listfile, names)
+        # Run 7z from the server directory so the relative names become archive names
+        subprocess.run([seven, 'a', '-t7z'] + get_7z_method_args(seven) + ['-scsUTF-8', backup_archive, f'@{listfile}'],
+                       cwd=minecraft_directory, check=True)
+    finally:
+        if os.path.exists(listfile):
+            os.remove(listfile)
+
+def create_tar_zst_archive(tar, zstd, backup_archive, names):
+    """Archive the named files and folders as a tar stream piped through multi-threaded zstd"""
+    listfile = os.path.join(BACKUP_DIR, '.tar_listfile.txt')
+    try:
+        _write_listfile(listfile, names)
+        tar_proc = subprocess.Popen([tar, '-cf', '-', '-C', minecraft_directory, '-T', listfile], stdout=subprocess.PIPE)
+        zstd_proc = subprocess.run([zstd, '-T0', f"-{COMPRESSION_TIERS[BACKUP_COMPRESSION]['zstd']}", '-q', '-o', backup_archive],
+                                   stdin=tar_proc.stdout)
+        tar_proc.stdout.close()
+        tar_returncode = tar_proc.wait()
+        # Check zstd first: if it died, tar only reports the broken pipe
+        zstd_proc.check_returncode()
+        if tar_returncode:
+            raise subprocess.CalledProcessError(tar_returncode, tar)
+    finally:
+        if os.path.exists(listfile):
+            os.remove(listfile)
+
+def build_backup_manifest(file_infos):
+    """Map each archive name to the size and mtime_ns of its file"""
+    return {relpath: {'size': size, 'mtime_ns': mtime_ns} for relpath, size, mtime_ns in file_infos}
+
+def load_backup_manifest():
+    """Load the manifest of the last backup, or None if there isn't a usable one"""
+    if os.path.exists(MANIFEST_FILE):
+        try:
+            manifest = read_json(MANIFEST_FILE)
+            if manifest.get('chain') and isinstance(manifest.get('files'), dict) \
+                    and all(isinstance(entry, dict) and 'archive' in entry for entry in manifest['files'].values()):
+                return manifest
+        except Exception:
+            pass
+    return None
+
+def save_backup_manifest(manifest):
+    """Save the manifest of the backup just made"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    write_json(MANIFEST_FILE, manifest)
+
+def backup_chain_exists(backup_archive):
+    """Check that a backup and, for an incremental one, every backup it builds on still exist"""
+    while os.path.exists(backup_archive):
+        name = os.path.basename(backup_archive)
+        for ext in ('.tar.zst', '.7z', '.zip'):
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+                break
+        sidecar = os.path.join(BACKUP_DIR, f"{name}.json")
+        if not os.path.exists(sidecar):
+            return True
+        try:
+            backup_archive = read_json(sidecar)['parent']
+        except Exception:
+            return False
+    return False
+
+def create_snapshot(backup_files, snapshot_dir):
+    """Copy the backup files into snapshot_dir, reflinking them where the filesystem allows"""
+    reflinked = 0
+    for file_path, arcname in backup_files:
+        dst_path = os.path.join(snapshot_dir, arcname)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        if snapshot_copy(file_path, dst_path):
+            reflinked += 1
+    if reflinked < len(backup_files):
+        print(f"Note: {len(backup_files) - reflinked} of {len(backup_files)} files could not be reflinked and were copied")
+
+def collect_empty_dirs(items_to_backup):
+    """Return the archive names of the empty folders below the backup items"""
+    empty_dirs = []
+    prefix_len = len(minecraft_directory) + 1
+    stack = [os.path.join(minecraft_directory, item) for item in items_to_backup
+             if os.path.isdir(os.path.join(minecraft_directory, item))]
+    while stack:
+        directory = stack.pop()
+        is_empty = True
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    is_empty = False
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+        except FileNotFoundError:
+            continue
+        if is_empty:
+            empty_dirs.append(directory[prefix_len:])
+    return empty_dirs
 
 def create_backup():
     # Get list of items to backup (excluding script, updater folder, and backup folder)
-    excluded_items = {
-        os.path.basename(__file__),  # Current script
+    excluded_items = frozenset({
+        SCRIPT_NAME,                 # Current script
         'updater',                   # Updater folder
         'backup'                     # Backup folder
-    }
+    })
     
+    backup_archive = None
     try:
         # Get list of items to backup
         items_to_backup = [item for item in os.listdir(minecraft_directory) if item not in excluded_items]
 
+        # Walk the server directory once; the hash, the manifest and every archiver reuse this scan
+        file_infos = scan_backup_files(items_to_backup)
+
         # Calculate hash of current folder contents
-        current_hash = calculate_folder_hash(items_to_backup)
+        current_hash = calculate_folder_hash(file_infos)
         
         # Load existing backup hashes
         backup_hashes = load_backup_hashes()
@@ -118,62 +399,151 @@ def create_backup():
         # Check if we already have a backup with this hash
         if current_hash in backup_hashes:
             existing_backup = backup_hashes[current_hash]
-            if os.path.exists(existing_backup):
+            # An incremental backup can only be restored if its whole chain is still there
+            if backup_chain_exists(existing_backup):
                 print(f"Skipping backup: Content identical to existing backup at {existing_backup}")
                 return existing_backup
             else:
-                # If the file doesn't exist anymore, remove it from our hash records
+                # If the backup or part of its chain is gone, remove it from our hash records
                 del backup_hashes[current_hash]
                 save_backup_hashes(backup_hashes)
 
+        # Every archiver reads straight from the source files
+        root = minecraft_directory + os.sep
+        backup_files = [(root + relpath, relpath) for relpath, size, mtime_ns in file_infos]
+
         # Create timestamp for backup file
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+        # Snapshot mode: on a reflink-capable filesystem this is metadata-only, so skip archiving
+        if BACKUP_SNAPSHOT:
+            backup_archive = os.path.join(BACKUP_DIR, f"Snapshot-{timestamp}")
+            print(f"Creating snapshot: {backup_archive}")
+            create_snapshot(backup_files, backup_archive)
+            backup_hashes[current_hash] = backup_archive
+            save_backup_hashes(backup_hashes)
+            print(f"Snapshot created successfully: {backup_archive}")
+            return backup_archive
         
+        # Only archive files whose size or mtime changed since the previous backup, unless
+        # a full backup is due or part of the previous chain has gone missing
+        current_files = build_backup_manifest(file_infos)
+        manifest = load_backup_manifest()
+        incremental = (manifest is not None
+                       and len(manifest['chain']) < BACKUP_FULL_EVERY
+                       and all(os.path.exists(path) for path in manifest['chain']))
+        if incremental:
+            # Unchanged files keep pointing at the archive that already holds them
+            previous_files = manifest['files']
+            archive_files = []
+            for file_path, arcname in backup_files:
+                previous = previous_files.get(arcname)
+                current = current_files[arcname]
+                if previous and previous['size'] == current['size'] and previous['mtime_ns'] == current['mtime_ns']:
+                    current['archive'] = previous['archive']
+                else:
+                    archive_files.append((file_path, arcname))
+            removed_files = sorted(set(previous_files) - set(current_files))
+            archive_name = f"Backup-{timestamp}-incr"
+            print(f"Incremental backup: {len(archive_files)} changed and {len(removed_files)} removed files since {manifest['chain'][-1]}")
+        else:
+            archive_files = backup_files
+            archive_name = f"Backup-{timestamp}"
+
+        # Full backups let 7z and tar walk the top-level items themselves, which keeps empty
+        # folders and copes with files LevelDB compacts away after the scan. Incremental
+        # backups name each changed file instead
+        archive_names = [arcname for file_path, arcname in archive_files] if incremental else items_to_backup
+
         # Try to use 7z (external) for faster archiving if available
         seven = shutil.which('7z') or shutil.which('7za') or shutil.which('7zr')
-        if seven:
-            backup_archive = os.path.join(minecraft_directory, 'backup', f"Backup-{timestamp}.7z")
-            print(f"Creating archive with 7z ({seven}): {backup_archive}")
+        if seven and archive_names:
+            backup_archive = os.path.join(BACKUP_DIR, f"{archive_name}.7z")
+            print(f"Creating archive with 7z ({seven}, {BACKUP_COMPRESSION}): {backup_archive}")
             try:
-                # Create list of items to archive
-                items_paths = [os.path.join(minecraft_directory, item) for item in items_to_backup]
-                # Run 7z directly on the source files
-                subprocess.run([seven, 'a', '-t7z', '-m0=LZMA2:d32m:fb32', '-mx=3', '-mmt=on', backup_archive] + items_paths, check=True)
-                # Save the hash
-                backup_hashes[current_hash] = backup_archive
-                save_backup_hashes(backup_hashes)
-                print(f"Backup archive created successfully: {backup_archive}")
-                return backup_archive
+                create_7z_archive(seven, backup_archive, archive_names)
             except subprocess.CalledProcessError as e:
                 print(f"7z failed ({e}), falling back to zip method")
-
-        # Fallback: create zip file directly from source files using no compression for speed
-        backup_zip = os.path.join(minecraft_directory, "backup", f"Backup-{timestamp}.zip")
-        print(f"Creating backup archive: {backup_zip}")
-        with zipfile.ZipFile(backup_zip, 'w', zipfile.ZIP_STORED) as zipf:
-            for item in items_to_backup:
-                item_path = os.path.join(minecraft_directory, item)
-                if os.path.isfile(item_path):
-                    zipf.write(item_path, item)
-                elif os.path.isdir(item_path):
-                    for root, dirs, files in os.walk(item_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, minecraft_directory)
-                            zipf.write(file_path, arcname)
-
-        # Save the hash
-        backup_hashes[current_hash] = backup_zip
+                if os.path.exists(backup_archive):
+                    os.remove(backup_archive)
+                backup_archive = None
+
+        # Otherwise stream a tar through zstd, which compresses on every core
+        tar = shutil.which('tar')
+        zstd = shutil.which('zstd')
+        if backup_archive is None and tar and zstd and archive_names:
+            backup_archive = os.path.join(BACKUP_DIR, f"{archive_name}.tar.zst")
+            print(f"Creating archive with tar and zstd ({BACKUP_COMPRESSION}): {backup_archive}")
+            try:
+                create_tar_zst_archive(tar, zstd, backup_archive, archive_names)
+            except subprocess.CalledProcessError as e:
+                print(f"tar/zstd failed ({e}), falling back to zip method")
+                if os.path.exists(backup_archive):
+                    os.remove(backup_archive)
+                backup_archive = None
+
+        if backup_archive is None:
+            # Fallback: create zip file directly from source files
+            backup_archive = os.path.join(BACKUP_DIR, f"{archive_name}.zip")
+            print(f"Creating backup archive: {backup_archive}")
+            level = COMPRESSION_TIERS[BACKUP_COMPRESSION]['deflate']
+            compression = zipfile.ZIP_STORED if level is None else zipfile.ZIP_DEFLATED
+            vanished_files = set()
+            with zipfile.ZipFile(backup_archive, 'w', compression, compresslevel=level) as zipf:
+                for file_path, arcname in archive_files:
+                    try:
+                        zipf.write(file_path, arcname)
+                    except FileNotFoundError:
+                        # LevelDB can delete a file, e.g. when compacting, after the scan saw it
+                        vanished_files.add(arcname)
+                if not incremental:
+                    # Keep empty folders, as 7z and tar do
+                    for dirname in collect_empty_dirs(items_to_backup):
+                        try:
+                            zipf.write(os.path.join(minecraft_directory, dirname), dirname)
+                        except FileNotFoundError:
+                            pass
+
+            # Files that vanished are not in this backup, so drop them from the manifest
+            if vanished_files:
+                print(f"Skipped {len(vanished_files)} files deleted during the backup")
+                archive_files = [(file_path, arcname) for file_path, arcname in archive_files
+                                 if arcname not in vanished_files]
+                for arcname in vanished_files:
+                    del current_files[arcname]
+                    if incremental and arcname in manifest['files']:
+                        removed_files.append(arcname)
+                if incremental:
+                    removed_files.sort()
+
+        for file_path, arcname in archive_files:
+            current_files[arcname]['archive'] = backup_archive
+
+        if incremental:
+            # Record which backup this one builds on, which files were deleted since then and
+            # which archive holds each file of this backup
+            write_json(os.path.join(BACKUP_DIR, f"{archive_name}.json"),
+                       {'parent': manifest['chain'][-1], 'removed': removed_files,
+                        'files': {arcname: entry['archive'] for arcname, entry in current_files.items()}},
+                       indent=True)
+            chain = manifest['chain'] + [backup_archive]
+        else:
+            chain = [backup_archive]
+
+        # Save the hash and the manifest the next incremental backup compares against
+        backup_hashes[current_hash] = backup_archive
         save_backup_hashes(backup_hashes)
-        print(f"Backup archive created successfully: {backup_zip}")
-        return backup_zip
+        save_backup_manifest({'chain': chain, 'files': current_files})
+        print(f"Backup archive created successfully: {backup_archive}")
+        return backup_archive
             
     except Exception as e:
         print(f"Error creating backup: {e}")
-        backup_zip = os.path.join(minecraft_directory, "backup", f"Backup-{timestamp}.zip")
         # Clean up if there was an error
-        if os.path.exists(backup_zip):
-            os.remove(backup_zip)
+        if backup_archive and os.path.isdir(backup_archive):
+            shutil.rmtree(backup_archive, ignore_errors=True)
+        elif backup_archive and os.path.exists(backup_archive):
+            os.remove(backup_archive)
         raise
 
 newInstall = False
@@ -188,8 +558,7 @@ if not os.path.isfile(server_exe):
     print("Getting Download Link...")
 
 # Create backup folder if it doesn't exist
-backup_folder = os.path.join(minecraft_directory, "backup")
-os.makedirs(backup_folder, exist_ok=True)
+os.makedirs(BACKUP_DIR, exist_ok=True)
 
 if not newInstall:
     print("Creating backup of server data...")
@@ -199,10 +568,31 @@ if not newInstall:
 URL = "https://www.minecraft.net/en-us/download/server/bedrock/"
 BACKUP_URL = "https://raw.githubusercontent.com/ghwns9652/Minecraft-Bedrock-Server-Updater/main/backup_download_link.txt"
 DOWNLOAD_LINKS_URL = "https://net-secondary.web.minecraft-services.net/api/v1.0/download/links"
-HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Sakiko/7999.0"}
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Sakiko/7999.0",
+           "Connection": "keep-alive"}
+
+# Share one session so downloads reuse pooled keep-alive connections instead of
+# opening a new TCP/TLS connection per request
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+VERSION_RE = re.compile(r'bedrock-server-(\d+\.\d+\.\d+\.\d+)')
+EXTRACT_BUFFER_SIZE = 1024 * 1024  # Read size when extracting server files
+DOWNLOAD_BUFFER_SIZE = 256 * 1024  # Read size per download worker
+
+# Top-level items kept from the existing install when updating
+PRESERVE_ITEMS = frozenset({
+    'config',
+    'behavior_packs',
+    'resource_packs',
+    'allowlist.json',
+    'permissions.json',
+    'server.properties'
+})
 
 try:
-    response = requests.get(DOWNLOAD_LINKS_URL, headers=HEADERS, timeout=5)
+    response = SESSION.get(DOWNLOAD_LINKS_URL, timeout=5)
     response_json = response.json()
     
     all_links = response_json['result']['links']
@@ -220,16 +610,16 @@ try:
 
 except requests.exceptions.Timeout:
     logging.error("timeout raised, recovering")
-    response = requests.get(BACKUP_URL, headers=HEADERS, timeout=5)
+    response = SESSION.get(BACKUP_URL, timeout=5)
 
     download_link=response.text
 
 # Read local version (if any) and skip update if already up-to-date
-version_file = os.path.join(minecraft_directory, 'updater', 'server_version.txt')
-os.makedirs(os.path.dirname(version_file), exist_ok=True)
+download_link_file = os.path.join(UPDATER_DIR, 'download_link.txt')
+os.makedirs(UPDATER_DIR, exist_ok=True)
 local_version = None
-if os.path.isfile(version_file):
-    with open(version_file, 'r') as f:
+if os.path.isfile(VERSION_FILE):
+    with open(VERSION_FILE, 'r') as f:
         local_version = f.read().strip()
         if not local_version:  # If file is empty, set to None
             local_version = None
@@ -241,8 +631,7 @@ else:
     print(f"Local server version {local_version}")
 
 # Extract version from download link
-import re
-version_match = re.search(r'bedrock-server-(\d+\.\d+\.\d+\.\d+)', download_link)
+version_match = VERSION_RE.search(download_link)
 version = version_match.group(1) if version_match else "unknown"
 print(f"Download link (version {version}):", download_link)
 
@@ -250,143 +639,318 @@ print(f"Download link (version {version}):", download_link)
 if not newInstall and local_version and local_version == version:
     print(f"Local server version {local_version} is up to date. No update needed.")
     # ensure download link file exists/updated
-    download_link_file = os.path.join(minecraft_directory, 'updater', 'download_link.txt')
     with open(download_link_file, 'w') as f:
         f.write(download_link)
     sys.exit(0)
 
-logfile = os.path.join(minecraft_directory, 'updater', 'update.log')
+logfile = os.path.join(UPDATER_DIR, 'update.log')
 
-resourceDir = os.path.join(minecraft_directory, 'updater', 'resources')
+resourceDir = os.path.join(UPDATER_DIR, 'resources')
 os.makedirs(resourceDir, exist_ok=True)
+# Older versions extracted into resources/temp; drop any copy an interrupted run left behind
+shutil.rmtree(os.path.join(resourceDir, 'temp'), ignore_errors=True)
 
 running_files = os.listdir(resourceDir)
 
+# Characters Windows doesn't allow in file names
+WINDOWS_ILLEGAL_CHARS = str.maketrans(':<>|"?*', '_______')
+
+# Split a zip member name into path components with the same rules as zipfile.extract:
+# drop any drive, and empty, '.' and '..' components, so members can't escape the
+# directory they are extracted into, and make the rest valid Windows file names
+def member_parts(zi):
+    name = zi.filename.replace('/', os.sep)
+    if os.altsep:
+        name = name.replace(os.altsep, os.sep)
+    name = os.path.splitdrive(name)[1]
+    parts = [part for part in name.split(os.sep) if part not in ('', '.', '..')]
+    if os.sep == '\\':
+        parts = [part.translate(WINDOWS_ILLEGAL_CHARS).rstrip('.') for part in parts]
+        parts = [part for part in parts if part]
+    return parts
+
+# Extract a single zip member with large reads
+def extract_member(zip_ref, zi, dest_root):
+    parts = member_parts(zi)
+    if not parts:
+        return
+    dest_path = os.path.join(dest_root, *parts)
+    if zi.is_dir():
+        os.makedirs(dest_path, exist_ok=True)
+        return
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    # 1MB reads let zipfile inflate large blocks instead of its 8KB default
+    with zip_ref.open(zi) as src, open(dest_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+
+# Remove the old copy of a top-level server item so files dropped from the new release don't linger
+def remove_item(item):
+    dst_path = os.path.join(minecraft_directory, item)
+    if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+        shutil.rmtree(dst_path)
+    elif os.path.lexists(dst_path):
+        os.remove(dst_path)
+
+_extract_local = threading.local()
+
+# Extract one member of the server zip into the server directory
+def install_member(server_zip, zi, open_zips):
+    # Each worker thread opens its own ZipFile handle so reads don't share a file position
+    zip_ref = getattr(_extract_local, 'zip_ref', None)
+    if zip_ref is None:
+        zip_ref = _extract_local.zip_ref = zipfile.ZipFile(server_zip, 'r')
+        open_zips.append(zip_ref)
+    extract_member(zip_ref, zi, minecraft_directory)
+
 # Function to download a chunk of the file
-def download_chunk(args):
+def download_chunk(args, mm):
     start, end, url = args
-    headers = {**HEADERS, 'Range': f'bytes={start}-{end}'}
-    response = requests.get(url, headers=headers)
-    return start, response.content
-# Download server file to resourceDir with version in filename
-server_zip = os.path.join(resourceDir, f'bedrock-server-{version}.zip')
-print(f"Downloading server version {version} to {server_zip}...")
-
-try:
-    # Get file size
-    response = requests.head(download_link, headers=HEADERS)
-    file_size = int(response.headers.get('content-length', 0))
-    
-    # Calculate chunk sizes
-    chunk_size = 1024 * 1024  # 1MB chunks
-    num_chunks = math.ceil(file_size / chunk_size)
+    # Stream the body through one small reusable buffer straight into the memory-mapped
+    # file, so each worker holds at most DOWNLOAD_BUFFER_SIZE bytes whatever the chunk size
+    length = end - start + 1
+    buf = bytearray(min(DOWNLOAD_BUFFER_SIZE, length))
+    view = memoryview(buf)
+    received = 0
+    with SESSION.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise Exception(f"Server ignored the range request for chunk {start}-{end}")
+        response.raw.decode_content = True
+        while received < length:
+            n = response.raw.readinto(view[:min(len(buf), length - received)])
+            if not n:
+                break
+            # Chunks never overlap, so workers write their slices without locking
+            mm[start + received:start + received + n] = view[:n]
+            received += n
+    if received != length:
+        raise Exception(f"Chunk {start}-{end} returned {received} bytes")
+    return received
+
+def download_with_aria2c(url, dest_path):
+    """Download url to dest_path with aria2c if it is installed. Returns True on success"""
+    aria2c = shutil.which('aria2c')
+    if not aria2c:
+        return False
+    # aria2c keeps 16 connections open and splits the file into 1MB pieces between them.
+    # Send the same browser User-Agent as SESSION; the CDN stalls other agents
+    result = subprocess.run([aria2c, '-x16', '-s16', '-k1M', '--file-allocation=none',
+                             '--allow-overwrite=true', '--auto-file-renaming=false',
+                             f"--user-agent={HEADERS['User-Agent']}",
+                             '-d', os.path.dirname(dest_path), '-o', os.path.basename(dest_path), url])
+    if result.returncode != 0:
+        print(f"aria2c failed with exit code {result.returncode}, falling back to the built-in downloader")
+        return False
+    return True
+
+def download_server_zip(url, dest_path):
+    """Download url to dest_path, using aria2c when available and parallel range requests otherwise"""
+    if download_with_aria2c(url, dest_path):
+        return
+
+    # Fetch the first chunk directly; its Content-Range also tells us the file size
+    response = SESSION.get(url, headers={'Range': f'bytes=0-{DOWNLOAD_CHUNK_SIZE - 1}'}, timeout=30)
+    response.raise_for_status()
+    first_chunk = response.content
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code == 206:
+        total = content_range.rsplit('/', 1)[-1]
+        if not total.isdigit():
+            raise Exception(f"Unexpected Content-Range: {content_range!r}")
+        file_size = int(total)
+    else:
+        # The server ignored the Range header and sent the whole file
+        file_size = len(first_chunk)
+    if file_size == 0:
+        raise Exception("Server returned an empty file")
+
+    # Split the rest into chunks large enough to amortise each request, while
+    # still giving every worker about four chunks on big files. Rounding up keeps
+    # a small leftover chunk from trailing behind the others
+    chunk_size = max(DOWNLOAD_CHUNK_SIZE, math.ceil((file_size - len(first_chunk)) / (DOWNLOAD_WORKERS * 4)))
     chunks = []
-    
-    for i in range(num_chunks):
-        start = i * chunk_size
+
+    for start in range(len(first_chunk), file_size, chunk_size):
         end = min(start + chunk_size - 1, file_size - 1)
-        chunks.append((start, end, download_link))
-    
-    # Download chunks in parallel with progress bar
-    with open(server_zip, 'wb') as f:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(download_chunk, chunk) for chunk in chunks]
-            
-            with tqdm(total=file_size, unit='B', unit_scale=True, desc="Downloading") as pbar:
-                downloaded = 0
-                for future in concurrent.futures.as_completed(futures):
-                    start, data = future.result()
-                    f.seek(start)
-                    f.write(data)
-                    downloaded += len(data)
-                    pbar.update(len(data))
-    
-    print("\nDownload completed successfully.")
-except Exception as e:
-    print(f"Error downloading server: {e}")
-    if os.path.exists(server_zip):
-        os.remove(server_zip)
-    exit(1)
+        chunks.append((start, end, url))
+
+    # Size the file up front and map it so each worker writes its own slice in place
+    with open(dest_path, 'w+b') as f:
+        f.truncate(file_size)
+        if hasattr(os, 'posix_fallocate'):
+            # Reserve the disk space now: a full disk then fails here with ENOSPC instead of
+            # crashing a worker with SIGBUS when it writes into a hole in the mapping
+            os.posix_fallocate(f.fileno(), 0, file_size)
+        with mmap.mmap(f.fileno(), file_size) as mm:
+            mm[:len(first_chunk)] = first_chunk
+
+            # Download chunks in parallel with progress bar
+            with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                futures = [executor.submit(download_chunk, chunk, mm) for chunk in chunks]
 
-# Create temp directory for extraction
-temp_dir = os.path.join(resourceDir, 'temp')
-os.makedirs(temp_dir, exist_ok=True)
-print(f"Extracting files to temporary directory: {temp_dir}")
+                try:
+                    with tqdm(total=file_size, unit='B', unit_scale=True, desc="Downloading") as pbar:
+                        # Batch progress updates: refresh at most every 250ms unless 4MB piled up
+                        unreported = len(first_chunk)
+                        last_update = time.monotonic()
+                        for future in concurrent.futures.as_completed(futures):
+                            unreported += future.result()
+                            now = time.monotonic()
+                            if unreported >= 4 * 1024 * 1024 or now - last_update >= 0.25:
+                                pbar.update(unreported)
+                                unreported = 0
+                                last_update = now
+                        pbar.update(unreported)
+                except BaseException:
+                    # Drop the queued chunks so a failure is reported now rather than after
+                    # every remaining request has also run into its timeout
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+def is_download_complete(url, zip_path):
+    """Check whether zip_path already holds the whole file served at url"""
+    if not os.path.isfile(zip_path):
+        return False
+    try:
+        response = SESSION.head(url, allow_redirects=True, timeout=10)
+        response.raise_for_status()
+        return int(response.headers.get('content-length', -1)) == os.path.getsize(zip_path)
+    except (requests.exceptions.RequestException, ValueError):
+        return False
+
+def find_zip_error(zip_path):
+    """Check every member's CRC, returning a description of the first problem or None"""
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            # testzip() reads each member in 1MB chunks, so zlib.crc32 runs over large buffers
+            bad_member = zip_ref.testzip()
+        return f"bad CRC in {bad_member}" if bad_member else None
+    except (zipfile.BadZipFile, zlib.error, OSError) as e:
+        return str(e)
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file, hashed in C without a Python read loop"""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        # Python < 3.11: hash the mapped file in one call
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+def is_download_intact(zip_path):
+    """Check zip_path against the SHA-256 recorded after downloading it, or its CRCs if none was recorded"""
+    digest_file = zip_path + '.sha256'
+    if os.path.isfile(digest_file):
+        with open(digest_file, 'r') as f:
+            return f.read().strip() == file_sha256(zip_path)
+    return find_zip_error(zip_path) is None
 
-# Clear the temp directory if it exists
-if os.path.exists(temp_dir):
-    for item in os.listdir(temp_dir):
-        item_path = os.path.join(temp_dir, item)
-        try:
-            if os.path.isfile(item_path):
-                os.unlink(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-        except Exception as e:
-            print(f"Error clearing temp directory: {e}")
+# Download server file to resourceDir with version in filename
+server_zip = os.path.join(resourceDir, f'bedrock-server-{version}.zip')
+if is_download_complete(download_link, server_zip) and is_download_intact(server_zip):
+    # Left behind by an earlier run that stopped before the update finished
+    print(f"Server version {version} already downloaded to {server_zip}, skipping download.")
+else:
+    print(f"Downloading server version {version} to {server_zip}...")
+    # Download to a .part file so a complete server_zip is never confused with an interrupted one
+    partial_zip = server_zip + '.part'
+    try:
+        download_server_zip(download_link, partial_zip)
+        # Verify the download before anything in the server directory is touched
+        zip_error = find_zip_error(partial_zip)
+        if zip_error:
+            raise Exception(f"downloaded file is corrupt ({zip_error})")
+        digest = file_sha256(partial_zip)
+        os.replace(partial_zip, server_zip)
+        # Record the digest so a later run can check a reused download without inflating it
+        with open(server_zip + '.sha256', 'w') as f:
+            f.write(digest)
+        print(f"\nDownload completed successfully (SHA-256 {digest}).")
+    except Exception as e:
+        print(f"Error downloading server: {e}")
+        if os.path.exists(partial_zip):
+            os.remove(partial_zip)
+        exit(1)
 
 try:
     with zipfile.ZipFile(server_zip, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
-    print("Files extracted successfully.")
-
-    # Update server files
-    print("\nUpdating server files...")
-
-    if newInstall:
-        # New install: copy all extracted items into the minecraft directory
-        print("New installation detected - copying all files.")
-        for item in os.listdir(temp_dir):
-            src_path = os.path.join(temp_dir, item)
-            dst_path = os.path.join(minecraft_directory, item)
-            try:
-                if os.path.exists(dst_path):
-                    if os.path.isfile(dst_path):
-                        os.remove(dst_path)
-                    else:
-                        shutil.rmtree(dst_path)
-
-                if os.path.isfile(src_path):
-                    shutil.copy2(src_path, dst_path)
-                    print(f"Copied: {item}")
-                elif os.path.isdir(src_path):
-                    shutil.copytree(src_path, dst_path)
-                    print(f"Copied: {item}/")
-            except Exception as e:
-                print(f"Error copying {item}: {e}")
-    else:
-        # Upgrade: preserve configuration and user data
-        preserve_items = {
-            'config',
-            'behavior_packs',
-            'resource_packs',
-            'allowlist.json',
-            'permissions.json',
-            'server.properties'
-        }
-
-        for item in os.listdir(temp_dir):
-            src_path = os.path.join(temp_dir, item)
-            dst_path = os.path.join(minecraft_directory, item)
-
-            if item not in preserve_items:
-                try:
-                    if os.path.exists(dst_path):
-                        if os.path.isfile(dst_path):
-                            os.remove(dst_path)
-                        else:
-                            shutil.rmtree(dst_path)
-                    
-                    if os.path.isfile(src_path):
-                        shutil.copy2(src_path, dst_path)
-                        print(f"Updated: {item}")
-                    elif os.path.isdir(src_path):
-                        shutil.copytree(src_path, dst_path)
-                        print(f"Updated: {item}/")
-                except Exception as e:
-                    print(f"Error updating {item}: {e}")
-            else:
+        # Group archive members by the top-level item they belong to, so preserving an
+        # item is one set lookup per item rather than a prefix match per member. Use the
+        # same sanitised components extract_member writes to, so a name like
+        # './server.properties' can't dodge PRESERVE_ITEMS or make the item '.'
+        members_by_item = {}
+        for zi in zip_ref.infolist():
+            parts = member_parts(zi)
+            if parts:
+                members_by_item.setdefault(parts[0], []).append(zi)
+
+        # Update server files by extracting straight into the server directory
+        print("\nUpdating server files...")
+
+        if newInstall:
+            # New install: extract every item into the minecraft directory
+            print("New installation detected - extracting all files.")
+            preserve_items = frozenset()
+            action = "Installed"
+        else:
+            # Upgrade: preserve configuration and user data
+            preserve_items = PRESERVE_ITEMS
+            action = "Updated"
+
+        items_to_install = {}
+        for item, members in members_by_item.items():
+            if item in preserve_items:
                 print(f"Preserved: {item}")
+            else:
+                items_to_install[item] = members
+
+        # Extract members in parallel; zlib releases the GIL while inflating
+        open_zips = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+                # Remove every old item before any new member lands in it
+                failed_items = set()
+                removals = {executor.submit(remove_item, item): item for item in items_to_install}
+                for future in concurrent.futures.as_completed(removals):
+                    item = removals[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed_items.add(item)
+                        print(f"Error updating {item}: {e}")
+
+                # Submit members largest first so a big file doesn't start last and finish alone
+                members_left = {}
+                futures = {}
+                all_members = []
+                for item, members in items_to_install.items():
+                    if item not in failed_items:
+                        members_left[item] = len(members)
+                        all_members.extend((zi, item) for zi in members)
+                all_members.sort(key=lambda member: member[0].file_size, reverse=True)
+                for zi, item in all_members:
+                    futures[executor.submit(install_member, server_zip, zi, open_zips)] = item
+
+                for future in concurrent.futures.as_completed(futures):
+                    item = futures[future]
+                    if item in failed_items:
+                        continue
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed_items.add(item)
+                        print(f"Error updating {item}: {e}")
+                        continue
+                    members_left[item] -= 1
+                    if members_left[item] == 0:
+                        is_dir = os.path.isdir(os.path.join(minecraft_directory, item))
+                        print(f"{action}: {item}/" if is_dir else f"{action}: {item}")
+        finally:
+            for zip_handle in open_zips:
+                zip_handle.close()
 
     print("\nServer files update completed.")
     # Set executable permissions on Linux
@@ -398,19 +962,13 @@ try:
     
     # After successful update, write the version and download link
     try:
-        version_file = os.path.join(minecraft_directory, 'updater', 'server_version.txt')
-        os.makedirs(os.path.dirname(version_file), exist_ok=True)
-        with open(version_file, 'w') as vf:
+        with open(VERSION_FILE, 'w') as vf:
             vf.write(version)
 
-        download_link_file = os.path.join(minecraft_directory, 'updater', 'download_link.txt')
         with open(download_link_file, 'w') as df:
             df.write(download_link)
-        
-        shutil.rmtree(temp_dir, ignore_errors=True)
     except Exception as e:
         print(f"Warning: failed to write version/link files: {e}")
 except Exception as e:
     print(f"Error during extraction or update: {e}")
-    shutil.rmtree(temp_dir, ignore_errors=True)
     exit(1)